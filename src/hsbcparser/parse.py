@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
+import io
 import os
 import re
+import shutil
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 from typing import NamedTuple, List, Iterator, Optional, Literal
 from datetime import date, datetime
-from subprocess import check_output, CalledProcessError
-from decimal import Decimal, ROUND_HALF_UP
+from subprocess import Popen, PIPE, CalledProcessError, check_call
+from tempfile import TemporaryDirectory
 
+import numpy as np
 import pandas as pd
 
 # --- Configuration ---
@@ -17,12 +23,34 @@ if not TABULA_PATH:
         "Please set it to the path of the Tabula JAR file."
     )
 
+# Encoding Tabula is run with and its CSV output is read with
+_TABULA_ENCODING = "windows-1252"
+
+
+# --- Patterns ---
+_MONTH = r"(?i:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)"
+# Date candidates; the month is checked separately so that a non-date like
+# '12 FOR 15' still consumes its digits, as in the original scan
+_DATE_RE = re.compile(r"\b\d{1,2} (?P<mon>[A-Za-z]{3}) \d{2}\b")
+# A whole well-formed transaction row: received date, transaction date,
+# details and a trailing amount with optional CR/DR suffix.
+_TXN_RE = re.compile(
+    rf'^(\d{{1,2}} {_MONTH}[ ,]\d{{2}})[ ,](\d{{1,2}} {_MONTH}[ ,]\d{{2}})(?!"*\w)'
+    rf'(.*?)(?<=[\s,"])(\d{{1,3}}(?:,\d{{3}})*\.\d{{2}})(CR|DR)?"?,?$'
+)
+_MONTHS = {mon: i for i, mon in enumerate(
+    ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"), start=1)}
+_DIGITS = frozenset("0123456789")
+# Characters try_transaction looks past before expecting the received date
+_ROW_PREFIX_CHARS = '", \t\r\n\x0b\x0c'
+_MAX_AMOUNT = 100_000_00  # pence
+
 
 # --- Data Models ---
 class Transaction(NamedTuple):
     received: date
     date: date
-    amount: Decimal
+    amount: int  # pence
     crdr: Literal["CR", "DR", "Payment"]
     is_contactless: bool
     details: str
@@ -31,7 +59,7 @@ class Transaction(NamedTuple):
 class NullTransaction(NamedTuple):
     received: Optional[date]
     date: Optional[date]
-    amount: Optional[Decimal]
+    amount: Optional[int]
     crdr: Optional[str]
     is_contactless: Optional[bool]
     details: str
@@ -44,18 +72,9 @@ def extract_dates(text: str) -> tuple[list[str], Optional[int], Optional[int]]:
     Returns (list of date strings, first index, last index).
     """
     text_normalised = text.replace(",", " ").replace('"', "")
-    pattern = r"\b\d{1,2} [A-Za-z]{3} \d{2}\b"
-    potential_matches = [(m.group(), m.start(), m.end() - 1)
-                         for m in re.finditer(pattern, text_normalised)]
-
-    valid_months = {"Jan", "Feb", "Mar", "Apr", "May", "Jun",
-                    "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"}
-
-    valid_matches = [
-        (txt, start, end)
-        for txt, start, end in potential_matches
-        if txt.split()[1].rstrip(",").capitalize() in valid_months
-    ]
+    valid_matches = [(m.group(), m.start(), m.end() - 1)
+                     for m in _DATE_RE.finditer(text_normalised)
+                     if m.group("mon").lower() in _MONTHS]
 
     if not valid_matches:
         return [], None, None
@@ -64,42 +83,171 @@ def extract_dates(text: str) -> tuple[list[str], Optional[int], Optional[int]]:
     return date_strs, valid_matches[0][1], valid_matches[-1][2]
 
 
+@lru_cache(maxsize=1024)
 def parse_date(date_str: str) -> datetime:
-    """Parse 'dd mmm yy' into datetime."""
+    """Parse 'dd mmm yy' into datetime. Cached, as dates repeat across rows."""
+    parts = date_str.split(" ")
     try:
+        if len(parts) == 3:
+            day, mon, yy = parts
+            month = _MONTHS.get(mon.lower())
+            if month and len(day) <= 2 and len(yy) == 2 and (day + yy).isdigit() and (day + yy).isascii():
+                # Same two-digit year pivot as strptime's %y
+                year = int(yy)
+                return datetime(year + (2000 if year < 69 else 1900), month, int(day))
+        # Anything unusual (extra whitespace, odd digits) gets strptime's rules
         return datetime.strptime(date_str, "%d %b %y")
     except ValueError as e:
         raise ValueError(f"Unable to parse date '{date_str}': {e}") from e
 
 
-def parse_transaction_amounts(text: str) -> list[tuple[Decimal, str]]:
+@lru_cache(maxsize=1024)
+def _row_date(date_str: str) -> date:
+    """parse_date for a row's leading date, which may have a comma before the year."""
+    return parse_date(date_str.replace(",", " ")).date()
+
+
+def _scan_amount_from_end(line: str, end: Optional[int] = None) -> Optional[tuple[int, str, Optional[str]]]:
     """
-    Extract transaction amounts and CR/DR suffix if present.
-    Returns list of (amount, crdr) tuples.
+    Find an 'ddd,ddd.dd' amount (optionally followed by CR/DR, a quote and a
+    comma) at the end of line[:end] by walking backwards, without the regex
+    engine. The amount must be preceded by a comma, quote or whitespace.
+    Returns (start index, amount string, suffix) or None.
+    """
+    if end is None:
+        end = len(line)
+    if line.endswith(",", 0, end):
+        end -= 1
+    if line.endswith('"', 0, end):
+        end -= 1
+    suffix = None
+    if line.endswith(("CR", "DR"), 0, end):
+        suffix = line[end - 2:end]
+        end -= 2
+
+    # Expect 'dd' after the decimal point
+    dot = end - 3
+    if dot < 0 or line[dot] != "." or line[dot + 1] not in _DIGITS or line[dot + 2] not in _DIGITS:
+        return None
+
+    # Walk back over digit groups; the leftmost group preceded by a delimiter wins
+    start = None
+    group_end = dot
+    while True:
+        i = group_end
+        while i > 0 and line[i - 1] in _DIGITS:
+            i -= 1
+        width = group_end - i
+        if not 1 <= width <= 3 or i == 0:
+            break
+        before = line[i - 1]
+        if before == "," or before == '"' or before.isspace():
+            start = i
+        if width != 3 or before != ",":
+            break
+        group_end = i - 1
+
+    if start is None:
+        return None
+    return start, line[start:dot + 3], suffix
+
+
+def _to_pence(num_str: str) -> int:
+    """Convert a 'ddd,ddd.dd' amount string to integer pence."""
+    # Always exactly two decimal places, so the digits alone are the pence
+    return int(num_str.replace(",", "").replace(".", ""))
+
+
+def _format_pence(pence: int) -> str:
+    """Format integer pence the way statements print them, e.g. '4,000.00'."""
+    return f"{pence // 100:,}.{pence % 100:02d}"
+
+
+def _clean_details(raw: str) -> str:
+    """Tidy the text preceding the amount, dropping the amount's opening quote."""
+    if raw.endswith('"'):
+        raw = raw[:-1]
+    return raw.replace(",", " ").strip()
+
+
+def _locate_amounts(text: str) -> list[tuple[int, str, int]]:
     """
-    pattern = r'(?:,|\s|\")(\d{1,3}(?:,\d{3})*\.\d{2})(CR|DR)?\"?,?$'
-    matches = re.findall(pattern, text, re.MULTILINE)
+    Like parse_transaction_amounts, but returns (amount in pence, crdr, start)
+    tuples, where start is the index in text of the amount's first digit.
+    """
+    matches = []
+    end = len(text)
+    while True:
+        found = _scan_amount_from_end(text, end)
+        if found is not None:
+            matches.append(found)
+        end = text.rfind("\n", 0, end)
+        if end == -1:
+            break
+    matches.reverse()
 
     if not matches:
         raise ValueError(f"No amounts with 2 decimal places found in text: {text}")
 
-    results = []
-    for num_str, suffix in matches:
-        cleaned = num_str.replace(",", "")
-        amount = Decimal(cleaned).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-        crdr = suffix or "Payment"
-        results.append((amount, crdr))
-    return results
+    return [(_to_pence(num_str), suffix or "Payment", start) for start, num_str, suffix in matches]
 
 
-def try_transaction(line: str) -> Iterator[Transaction | NullTransaction]:
+def parse_transaction_amounts(text: str) -> list[tuple[int, str]]:
+    """
+    Extract transaction amounts and CR/DR suffix if present.
+    Returns list of (amount in pence, crdr) tuples.
+    """
+    return [(amount, crdr) for amount, crdr, _ in _locate_amounts(text)]
+
+
+def _transaction_from_match(m: re.Match) -> Transaction:
+    """Build a Transaction from a _TXN_RE match."""
+    # Same integrity check as try_transaction: only the two leading dates
+    extra_dates, _, _ = extract_dates(m.string[m.start(3):])
+    if extra_dates:
+        raise ValueError(f"Expected 2 dates, found {2 + len(extra_dates)}: {m.group()}")
+
+    amount = _to_pence(m.group(4))
+
+    # Integrity check: amounts shouldn't be absurd
+    if amount > _MAX_AMOUNT:
+        raise ValueError(f"Unusually large amount: {_format_pence(amount)} in line: {m.group()}")
+
+    details = _clean_details(m.group(3))
+
+    return Transaction(
+        received=_row_date(m.group(1)),
+        date=_row_date(m.group(2)),
+        amount=amount,
+        crdr=m.group(5) or "Payment",
+        is_contactless=details.startswith(")))"),
+        details=details,
+    )
+
+
+def try_transaction(line: str, yield_only_transactions: bool = True) -> Iterator[Transaction | NullTransaction]:
     """
     Try to parse a line into Transaction(s). Returns a generator.
-    Yields either Transaction or NullTransaction.
+    Yields Transactions; non-transaction lines yield nothing, or a
+    NullTransaction if yield_only_transactions is False.
     """
+    # Transaction rows start with the received date; skip the date regex for
+    # headers, footers and anything else that cannot be one. Leading quotes,
+    # commas and whitespace are skipped so misplaced dates still get rejected.
+    if line.lstrip(_ROW_PREFIX_CHARS)[:1] not in _DIGITS:
+        if not yield_only_transactions:
+            yield NullTransaction(None, None, None, None, None, line)
+        return
+
+    m = _TXN_RE.match(line)
+    if m:
+        yield _transaction_from_match(m)
+        return
+
     re_dates, first_ix, last_ix = extract_dates(line)
     if not re_dates:
-        yield NullTransaction(None, None, None, None, None, line)
+        if not yield_only_transactions:
+            yield NullTransaction(None, None, None, None, None, line)
         return
 
     if len(re_dates) != 2:
@@ -111,26 +259,21 @@ def try_transaction(line: str) -> Iterator[Transaction | NullTransaction]:
     rdate, ddate = [parse_date(d) for d in re_dates]
 
     remaining_line = line[last_ix + 1:]
-    amounts = parse_transaction_amounts(remaining_line)
+    amounts = _locate_amounts(remaining_line)
     if len(amounts) != 1:
         raise ValueError(f"Expected 1 amount, found {len(amounts)}: {line}")
 
-    amount, crdr = amounts[0]
+    amount, crdr, amount_start = amounts[0]
 
     if crdr not in ['CR', 'DR', 'Payment']:
         raise ValueError(f'Unrecognised payment type string: {crdr}')
 
     # Integrity check: amounts shouldn't be absurd
-    if amount > Decimal("100000.00"):
-        raise ValueError(f"Unusually large amount: {amount} in line: {line}")
+    if amount > _MAX_AMOUNT:
+        raise ValueError(f"Unusually large amount: {_format_pence(amount)} in line: {line}")
 
-    str_amount = f"{amount:,}"
-    amount_start = remaining_line.find(str_amount)
-    if amount_start == -1:
-        raise ValueError(f"Could not locate amount text in line: {line}")
-
-    amount_end = amount_start + len(str_amount)
-    details = (remaining_line[:amount_start] + remaining_line[amount_end:]).replace(",", " ").strip()
+    # The amount and its suffix run to the end of the line
+    details = _clean_details(remaining_line[:amount_start])
 
     is_contactless = details.startswith(")))")
 
@@ -145,32 +288,94 @@ def try_transaction(line: str) -> Iterator[Transaction | NullTransaction]:
 
 
 # --- I/O and orchestration ---
-def yield_credit_infos(fname: str | Path) -> Iterator[Transaction | NullTransaction]:
+def _tabula_cmd(*args: str) -> list[str]:
     """
-    Run Tabula on a PDF and yield parsed transactions.
+    Build a Tabula command line for args. Java's default charset is UTF-8
+    from JDK 18, and System.out follows stdout.encoding from JDK 19, so pin
+    both to _TABULA_ENCODING for the CSV files and stdout alike.
     """
-    cmd = [
+    return [
         "java",
+        f"-Dfile.encoding={_TABULA_ENCODING}",
+        f"-Dstdout.encoding={_TABULA_ENCODING}",
         "-jar", TABULA_PATH,
         "--pages", "all",
         "--silent",
-        str(fname),
+        *args,
     ]
 
+
+@contextmanager
+def _tabula_errors(fnames: str | Path) -> Iterator[None]:
+    """Turn failures to start or run Tabula on fnames into RuntimeErrors."""
     try:
-        res = check_output(cmd).decode("windows-1252")
+        yield
     except FileNotFoundError as e:
         raise RuntimeError("Java not found or TABULA_JAR_PATH invalid") from e
     except CalledProcessError as e:
-        raise RuntimeError(f"Tabula command failed: {e}") from e
+        raise RuntimeError(f"Tabula command failed for {fnames}: {e}") from e
 
-    for line in res.splitlines():
-        yield from try_transaction(line)
+
+def yield_credit_infos(
+    fname: str | Path, yield_only_transactions: bool = True
+) -> Iterator[Transaction | NullTransaction]:
+    """
+    Run Tabula on a PDF and yield parsed transactions as its output streams in.
+    Pass yield_only_transactions=False to also get a NullTransaction per other line.
+    """
+    cmd = _tabula_cmd(str(fname))
+    with _tabula_errors(fname):
+        proc = Popen(cmd, stdout=PIPE)
+
+    # Parse rows as Tabula emits them rather than buffering the whole output
+    with proc:
+        for line in io.TextIOWrapper(proc.stdout, encoding=_TABULA_ENCODING):
+            yield from try_transaction(line.rstrip("\n"), yield_only_transactions)
+
+    if proc.returncode:
+        with _tabula_errors(fname):
+            raise CalledProcessError(proc.returncode, cmd)
 
 
-def get_credit_infos(fname: str | Path) -> List[Transaction | NullTransaction]:
+def get_credit_infos(
+    fname: str | Path, yield_only_transactions: bool = True
+) -> List[Transaction | NullTransaction]:
     """Convenience wrapper to return all transactions from a single file."""
-    return list(yield_credit_infos(fname))
+    return list(yield_credit_infos(fname, yield_only_transactions))
+
+
+def _batch_credit_infos(pdfs: list[Path]) -> list[list[Transaction]]:
+    """
+    Run a single Tabula JVM over several PDFs and return each one's
+    transactions, in order. Saves a JVM start-up per PDF.
+    """
+    names = ", ".join(pdf_path.name for pdf_path in pdfs)
+    with TemporaryDirectory() as tmp:
+        # --batch converts every '*.pdf' (lower case only) in a directory,
+        # writing a .csv beside each, so link the PDFs in under index names
+        links = [Path(tmp, f"{i}.pdf") for i in range(len(pdfs))]
+        for pdf_path, link in zip(pdfs, links):
+            try:
+                os.symlink(pdf_path.resolve(), link)
+            except OSError:
+                shutil.copyfile(pdf_path, link)
+
+        with _tabula_errors(names):
+            check_call(_tabula_cmd("--batch", tmp))
+
+        results = []
+        for pdf_path, link in zip(pdfs, links):
+            try:
+                f = open(link.with_suffix(".csv"), encoding=_TABULA_ENCODING)
+            except FileNotFoundError as e:
+                raise RuntimeError(f"Tabula produced no output for {pdf_path} (batch: {names})") from e
+            with f:
+                results.append([t for line in f for t in try_transaction(line.rstrip("\n"))])
+        return results
+
+
+# Dataframe column for each Transaction field, in field order
+_TRANSACTION_COLUMNS = ("received_date", "transaction_date", "amount_pence", "crdr", "is_contactless", "details")
 
 
 def make_dataframe_from_path(pdf_folder_path: str | Path) -> pd.DataFrame:
@@ -182,19 +387,31 @@ def make_dataframe_from_path(pdf_folder_path: str | Path) -> pd.DataFrame:
     if not pdfs:
         raise FileNotFoundError(f"No PDF files found in {pdf_folder}")
 
-    rows = []
-    for pdf_path in pdfs:
-        sdate = datetime.strptime(pdf_path.name[:10], "%Y-%m-%d").date()
-        for t in get_credit_infos(pdf_path):
-            rows.append({
-                "statement_fpath": pdf_path,
-                "statement_date": sdate,
-                "received_date": t.received,
-                "transaction_date": t.date,
-                "amount": float(t.amount) if t.amount is not None else None,
-                "crdr": t.crdr,
-                "is_contactless": t.is_contactless,
-                "details": t.details,
-            })
-
-    return pd.DataFrame(rows)
+    sdates = [datetime.strptime(pdf_path.name[:10], "%Y-%m-%d").date() for pdf_path in pdfs]
+
+    # One batch Tabula JVM per worker, each taking an interleaved share of the PDFs
+    n_workers = min(os.cpu_count() or 1, len(pdfs))
+    chunks = [pdfs[i::n_workers] for i in range(n_workers)]
+    with ProcessPoolExecutor(max_workers=n_workers) as ex:
+        by_pdf = {
+            pdf_path: transactions
+            for chunk, chunk_results in zip(chunks, ex.map(_batch_credit_infos, chunks))
+            for pdf_path, transactions in zip(chunk, chunk_results)
+        }
+    results = [by_pdf[pdf_path] for pdf_path in pdfs]
+
+    # Accumulate columns directly rather than one dict per row
+    cols = {name: [] for name in ("statement_fpath", "statement_date", *_TRANSACTION_COLUMNS)}
+    for pdf_path, sdate, transactions in zip(pdfs, sdates, results):
+        cols["statement_fpath"] += [pdf_path] * len(transactions)
+        cols["statement_date"] += [sdate] * len(transactions)
+        for name, values in zip(_TRANSACTION_COLUMNS, zip(*transactions)):
+            cols[name] += values
+
+    pence = np.array(cols["amount_pence"], dtype=np.int64)
+    cols["amount_pence"] = pence
+    cols["is_contactless"] = np.array(cols["is_contactless"], dtype=bool)
+    cols["crdr"] = pd.Categorical(cols["crdr"], categories=["CR", "DR", "Payment"])
+    df = pd.DataFrame(cols, copy=False)
+    df.insert(df.columns.get_loc("amount_pence"), "amount", pence / 100)
+    return df
@@ -1,22 +1,42 @@
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
 import pytest
-from decimal import Decimal
-from hsbcparser.parse import parse_transaction_amounts
+from datetime import date, datetime
+from hsbcparser import parse
+from hsbcparser.parse import (
+    NullTransaction,
+    Transaction,
+    get_credit_infos,
+    make_dataframe_from_path,
+    parse_date,
+    parse_transaction_amounts,
+    try_transaction,
+)
 
 
 @pytest.mark.parametrize(
     "text,expected",
     [
-        ("02 May 22 30 Apr 22,,MS NEWSAGENT LONDIS,LONDON SW19,101.50", [(Decimal("101.50"), "Payment")]),
-        ("03 Jun 23,02 Jun 23,BKG*HOTEL AT BOOKING.C (888)850-3958,376.34", [(Decimal("376.34"), "Payment")]),
-        ("19 Dec 23 18 Dec 23 IAP trainline,,+443332022222,127.29", [(Decimal("127.29"), "Payment")]),
-        ("DIRECT DEBIT PAYMENT - THANK YOU,,730.00CR", [(Decimal("730.00"), "CR")]),
-        ("SOME TRANSACTION DESCRIPTION,,456.78DR", [(Decimal("456.78"), "DR")]),
-        ("QUOTED TRANSACTION,,123.45\"", [(Decimal("123.45"), "Payment")]),
-        ("QUOTED CREDIT,,678.90CR\"", [(Decimal("678.90"), "CR")]),
-        ("QUOTED DEBIT,,234.56DR\"", [(Decimal("234.56"), "DR")]),
-        ("COMMA ENDING,,100.00,", [(Decimal("100.00"), "Payment")]),
-        ("QUOTED COMMA,,200.00CR\",", [(Decimal("200.00"), "CR")]),
-        ("28 May 24 28 May,24 PAYMENT - THANK YOU,\"4,000.00CR\"", [(Decimal("4000.00"), "CR")]),
+        ("02 May 22 30 Apr 22,,MS NEWSAGENT LONDIS,LONDON SW19,101.50", [(10150, "Payment")]),
+        ("03 Jun 23,02 Jun 23,BKG*HOTEL AT BOOKING.C (888)850-3958,376.34", [(37634, "Payment")]),
+        ("19 Dec 23 18 Dec 23 IAP trainline,,+443332022222,127.29", [(12729, "Payment")]),
+        ("DIRECT DEBIT PAYMENT - THANK YOU,,730.00CR", [(73000, "CR")]),
+        ("SOME TRANSACTION DESCRIPTION,,456.78DR", [(45678, "DR")]),
+        ("QUOTED TRANSACTION,,123.45\"", [(12345, "Payment")]),
+        ("QUOTED CREDIT,,678.90CR\"", [(67890, "CR")]),
+        ("QUOTED DEBIT,,234.56DR\"", [(23456, "DR")]),
+        ("COMMA ENDING,,100.00,", [(10000, "Payment")]),
+        ("QUOTED COMMA,,200.00CR\",", [(20000, "CR")]),
+        ("28 May 24 28 May,24 PAYMENT - THANK YOU,\"4,000.00CR\"", [(400000, "CR")]),
+        ("LONDON SW19,101.50", [(10150, "Payment")]),
+        ("SMALL CHANGE,0.05", [(5, "Payment")]),
+        ("LARGE PURCHASE, 12,345.67", [(1234567, "Payment")]),
     ],
 )
 def test_parse_transaction_amounts(text, expected):
@@ -26,3 +46,222 @@ def test_parse_transaction_amounts(text, expected):
 def test_parse_transaction_amounts_raises_on_no_match():
     with pytest.raises(ValueError, match="No amounts with 2 decimal places"):
         parse_transaction_amounts("This line has no amount")
+
+
+@pytest.mark.parametrize("text", ["NO DELIMITER,1234.56", "ONE DECIMAL,12.3", "AT START 12.34 ,"])
+def test_parse_transaction_amounts_rejects_malformed(text):
+    with pytest.raises(ValueError, match="No amounts with 2 decimal places"):
+        parse_transaction_amounts(text)
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        "",
+        "Statement Date 02 May 22",
+        "Page 1 of 3",
+        # Letter-led rows are skipped without the date regex, even with a
+        # misplaced received date (compare the leading comma case below)
+        "X 02 May 22 30 Apr 22,X,1.00",
+    ],
+)
+def test_try_transaction_skips_non_transaction_lines(line):
+    assert list(try_transaction(line)) == []
+    assert list(try_transaction(line, yield_only_transactions=False)) == [
+        NullTransaction(None, None, None, None, None, line)
+    ]
+
+
+TABULA_OUTPUT = "\r\n".join([
+    "Statement Date 02 May 22",
+    "02 May 22 30 Apr 22,,MS NEWSAGENT LONDIS,LONDON SW19,101.50",
+    "03 Jun 23,02 Jun 23,\")))COFFEE SHOP\",4.20",
+    "",
+    "28 May 24 28 May,24 PAYMENT - THANK YOU,\"4,000.00CR\"",
+]) + "\r\n"
+
+
+def fake_tabula(monkeypatch, output, returncode=0):
+    """Make yield_credit_infos run a Python stand-in for Tabula."""
+    calls = []
+    script = f"import sys; sys.stdout.buffer.write({output.encode('windows-1252')!r}); sys.exit({returncode})"
+
+    def fake_popen(cmd, **kw):
+        calls.append(cmd)
+        return subprocess.Popen([sys.executable, "-c", script], **kw)
+
+    monkeypatch.setattr(parse, "Popen", fake_popen)
+    return calls
+
+
+def test_get_credit_infos_parses_tabula_output(monkeypatch):
+    fake_tabula(monkeypatch, TABULA_OUTPUT)
+    expected = [t for line in TABULA_OUTPUT.splitlines() for t in try_transaction(line, yield_only_transactions=False)]
+    assert get_credit_infos("statement.pdf", yield_only_transactions=False) == expected
+    assert get_credit_infos("statement.pdf") == [t for t in expected if isinstance(t, Transaction)]
+    assert expected[1] == Transaction(
+        received=date(2022, 5, 2),
+        date=date(2022, 4, 30),
+        amount=10150,
+        crdr="Payment",
+        is_contactless=False,
+        details="MS NEWSAGENT LONDIS LONDON SW19",
+    )
+    assert expected[4].details == "PAYMENT - THANK YOU"
+    assert [type(t) for t in expected] == [NullTransaction, Transaction, Transaction, NullTransaction, Transaction]
+
+
+def test_get_credit_infos_keeps_non_ascii_details(monkeypatch):
+    calls = fake_tabula(monkeypatch, "02 May 22 30 Apr 22,,CAFÉ CRÈME £5 OFF,4.20\r\n")
+
+    [t] = get_credit_infos("statement.pdf")
+    assert t.details == "CAFÉ CRÈME £5 OFF"
+    assert "-Dfile.encoding=windows-1252" in calls[0]
+    assert "-Dstdout.encoding=windows-1252" in calls[0]
+
+
+def test_try_transaction_raises_on_extra_date():
+    with pytest.raises(ValueError, match="Expected 2 dates"):
+        list(try_transaction("02 May 22 30 Apr 22,,REFUND 01 Jan 22,101.50"))
+
+
+@pytest.mark.parametrize(
+    "line,details",
+    [
+        ("02 May 22 30 Apr 22,,TICKET 12 FOR 15 Jan 23,1.00", "TICKET 12 FOR 15 Jan 23"),
+        ("02 May 22 30 Apr 22,,UNIT 3 BLK 22 Mar 23,1.00", "UNIT 3 BLK 22 Mar 23"),
+    ],
+)
+def test_try_transaction_ignores_date_after_non_month_candidate(line, details):
+    # 'FOR 15' / 'BLK 22' look like a date and take the day, as they always have
+    [t] = try_transaction(line)
+    assert t.details == details
+
+
+def test_get_credit_infos_raises_on_tabula_failure(monkeypatch):
+    fake_tabula(monkeypatch, "", returncode=1)
+    with pytest.raises(RuntimeError, match="Tabula command failed"):
+        get_credit_infos("statement.pdf")
+
+
+def test_try_transaction_raises_on_unusually_large_amount():
+    with pytest.raises(ValueError, match="Unusually large amount: 100,000.01"):
+        list(try_transaction("02 May 22 30 Apr 22,,CAR DEALER,100,000.01"))
+
+
+@pytest.mark.parametrize(
+    "line,crdr,details",
+    [
+        ("02 May 22 30 Apr 22,,DIRECT DEBIT PAYMENT - THANK YOU,,730.00CR", "CR", "DIRECT DEBIT PAYMENT - THANK YOU"),
+        ("02 May 22 30 Apr 22,\")))SHOP, LONDON\",456.78DR\"", "DR", "\")))SHOP  LONDON\""),
+        ("02 May 22, 30 Apr 22,REF 101.50,101.50", "Payment", "REF 101.50"),
+    ],
+)
+def test_try_transaction_details_exclude_amount(line, crdr, details):
+    [t] = try_transaction(line)
+    assert (t.crdr, t.details) == (crdr, details)
+
+
+@pytest.mark.parametrize(
+    "date_str,expected",
+    [
+        ("02 May 22", datetime(2022, 5, 2)),
+        ("1 jan 68", datetime(2068, 1, 1)),
+        ("31 DEC 69", datetime(1969, 12, 31)),
+        ("29 Feb  24", datetime(2024, 2, 29)),
+    ],
+)
+def test_parse_date(date_str, expected):
+    assert parse_date(date_str) == expected
+
+
+@pytest.mark.parametrize("date_str", ["29 Feb 23", "12 Xyz 22", "123 May 22"])
+def test_parse_date_raises_on_invalid(date_str):
+    with pytest.raises(ValueError, match="Unable to parse date"):
+        parse_date(date_str)
+
+
+def fake_batch_tabula(monkeypatch, outputs):
+    """Make _batch_credit_infos run a stand-in for `tabula --batch DIR`."""
+    calls = []
+
+    def fake_check_call(cmd):
+        calls.append(cmd)
+        # Write a CSV next to each linked PDF, keyed by the original file name
+        batch_dir = Path(cmd[cmd.index("--batch") + 1])
+        for pdf in batch_dir.glob("*.pdf"):
+            output = outputs[pdf.resolve().name]
+            if output is not None:
+                pdf.with_suffix(".csv").write_bytes(output.encode("windows-1252"))
+
+    monkeypatch.setattr(parse, "check_call", fake_check_call)
+    return calls
+
+
+def test_batch_credit_infos_reads_one_csv_per_pdf(monkeypatch, tmp_path):
+    pdfs = [tmp_path / "2022-05-01.pdf", tmp_path / "2022-06-01.PDF"]
+    for pdf in pdfs:
+        pdf.touch()
+    lines = TABULA_OUTPUT.splitlines()
+    calls = fake_batch_tabula(monkeypatch, {pdfs[0].name: lines[1], pdfs[1].name: lines[2]})
+
+    results = parse._batch_credit_infos(pdfs)
+    assert [[t.amount for t in ts] for ts in results] == [[10150], [420]]
+    assert "-Dfile.encoding=windows-1252" in calls[0]
+    assert "-Dstdout.encoding=windows-1252" in calls[0]
+
+
+def test_batch_credit_infos_keeps_non_ascii_details(monkeypatch, tmp_path):
+    pdf = tmp_path / "2022-05-01.pdf"
+    pdf.touch()
+    fake_batch_tabula(monkeypatch, {pdf.name: "02 May 22 30 Apr 22,,CAFÉ CRÈME £5 OFF,4.20\r\n"})
+
+    [[t]] = parse._batch_credit_infos([pdf])
+    assert t.details == "CAFÉ CRÈME £5 OFF"
+
+
+def test_batch_credit_infos_names_pdf_without_output(monkeypatch, tmp_path):
+    pdfs = [tmp_path / "2022-05-01.pdf", tmp_path / "2022-06-01.pdf"]
+    for pdf in pdfs:
+        pdf.touch()
+    fake_batch_tabula(monkeypatch, {pdfs[0].name: "", pdfs[1].name: None})
+
+    with pytest.raises(RuntimeError, match="no output for .*2022-06-01.pdf"):
+        parse._batch_credit_infos(pdfs)
+
+
+@pytest.mark.parametrize("line", [",02 May 22 30 Apr 22,X,1.00", " 02 May 22 30 Apr 22,X,1.00"])
+def test_try_transaction_raises_on_misplaced_received_date(line):
+    with pytest.raises(ValueError, match="Unexpected received-date placement"):
+        list(try_transaction(line))
+
+
+def test_make_dataframe_from_path(monkeypatch, tmp_path):
+    outputs = {
+        "2022-05-01.pdf": TABULA_OUTPUT,
+        "2022-06-01.pdf": "Statement Date 01 Jun 22\r\nNo transactions this month\r\n",
+        "2022-07-01.pdf": "02 Jul 22 01 Jul 22,,CAFE,1,234.56DR\r\n",
+    }
+    for name in outputs:
+        (tmp_path / name).touch()
+    fake_batch_tabula(monkeypatch, outputs)
+    # Two in-process workers, so the fake applies and the PDFs are split across chunks
+    monkeypatch.setattr(parse, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(os, "cpu_count", lambda: 2)
+
+    df = make_dataframe_from_path(tmp_path)
+
+    assert list(df.columns) == [
+        "statement_fpath", "statement_date", "received_date", "transaction_date",
+        "amount", "amount_pence", "crdr", "is_contactless", "details",
+    ]
+    assert df["amount"].dtype == np.float64
+    assert df["amount_pence"].dtype == np.int64
+    assert isinstance(df["crdr"].dtype, pd.CategoricalDtype)
+    assert list(df["crdr"].cat.categories) == ["CR", "DR", "Payment"]
+    assert df["is_contactless"].dtype == bool
+    assert list(df["statement_date"]) == [date(2022, 5, 1)] * 3 + [date(2022, 7, 1)]
+    assert list(df["statement_fpath"]) == [tmp_path / "2022-05-01.pdf"] * 3 + [tmp_path / "2022-07-01.pdf"]
+    assert list(df["amount_pence"]) == [10150, 420, 400000, 123456]
+    assert list(df["crdr"]) == ["Payment", "Payment", "CR", "DR"]
+    assert (df["amount"] == df["amount_pence"] / 100).all()